@@ -1,38 +1,226 @@
 # app.py
 
+import hashlib
+import io
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 st.set_page_config(page_title="Fluxo de Caixa", layout="wide")
 st.title("Sistema de Fluxo de Caixa Diário")
 
+# Padrões de nome que identificam colunas de data e de valor
+DATE_COL_RE = re.compile("Data")
+NUM_COL_RE  = re.compile("Valor|Acréscimo|Desconto|Seguro|Taxa")
+# Fuso no fim de um horário ("10:00:00-03:00", "10:00Z"): o grupo é o horário
+TZ_SUFFIX_RE = re.compile(r"(\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)\s*(?:Z|[+-]\d{2}(?::?\d{2})?)$")
+
+# --- Conversão de números no formato brasileiro (1.234,56) ---
+def to_br_float(s):
+    # Kernels de string do Arrow: sem alocar um objeto Python por célula
+    arr = pa.array(s, type=pa.string(), from_pandas=True)
+    arr = pc.utf8_trim_whitespace(pc.replace_substring(arr, "R$", ""))
+    # Só remove o ponto de milhar (seguido de exatamente 3 dígitos): um valor
+    # como "1.5" não vira 15
+    arr = pc.replace_substring_regex(arr, r"\.(\d{3})\b", r"\1")
+    arr = pc.replace_substring(arr, ",", ".")
+    return pd.to_numeric(pd.Series(arr.to_pandas(), index=s.index), errors="coerce")
+
+# --- Converte só os valores distintos e espalha o resultado pelos códigos ---
+def converte_unicos(s, conv):
+    codes, unicos = pd.factorize(s)
+    valores = conv(pd.Series(unicos)).to_numpy(dtype=float)
+    # código -1 (nulo) aponta para o NaN acrescentado no fim
+    return pd.Series(np.append(valores, np.nan)[codes], index=s.index)
+
+# --- Uma passada de datas em formato único de saída ---
+def para_datetime(s, **kw):
+    # Cada passada pode devolver outra unidade (s/ms/us) ou vir com fuso;
+    # normaliza para horário local sem fuso, em us, para poder combinar
+    out = pd.to_datetime(s, errors="coerce", cache=True, **kw)
+    if out.dt.tz is not None:
+        out = out.dt.tz_localize(None)
+    return out.astype("datetime64[us]")
+
+# --- Leitura de CSV: leitor multithread do pyarrow com todas as colunas como
+# texto. O engine="pyarrow" do pandas infere os tipos antes de aplicar
+# dtype=str ("1.230" vira "1.23", "00123" vira "123", horário com fuso vira UTC) ---
+def le_csv(data):
+    opts = pacsv.ParseOptions(delimiter=";")
+    try:
+        nomes = pacsv.open_csv(io.BytesIO(data), parse_options=opts).schema.names
+        # Cabeçalho repetido: column_types não distingue as cópias
+        if len(set(nomes)) == len(nomes):
+            tabela = pacsv.read_csv(
+                io.BytesIO(data),
+                parse_options=opts,
+                convert_options=pacsv.ConvertOptions(
+                    column_types=dict.fromkeys(nomes, pa.string()),
+                    strings_can_be_null=True,
+                ),
+            )
+            return tabela.to_pandas()
+    except pa.ArrowInvalid:
+        pass
+    # Motor C: renomeia cabeçalhos repetidos para "X.1" e aceita o que o Arrow recusa
+    return pd.read_csv(io.BytesIO(data), sep=";", dtype=str)
+
 # --- Função de leitura e normalização ---
 def parse_file(uploaded, is_excel, dayfirst, dec_br):
     if uploaded is None:
-        return None
+        return None, (), None
+    # Os bytes do arquivo servem de chave do cache entre reruns
+    try:
+        return _parse_bytes(uploaded.getvalue(), is_excel, dayfirst, dec_br)
+    except Exception as e:
+        # Arquivo ilegível não derruba o rerun: avisa e segue como se não houvesse upload
+        st.error(f"Não foi possível ler {uploaded.name}: {e}")
+        return None, (), None
+
+# --- Leitura dos uploads em paralelo: o leitor CSV do pyarrow trabalha
+# fora do GIL, então cada arquivo roda em sua própria thread ---
+def parse_files(*jobs):
+    ctx = get_script_run_ctx()
+    def _init():
+        add_script_run_ctx(threading.current_thread(), ctx)
+    with ThreadPoolExecutor(max_workers=len(jobs), initializer=_init) as ex:
+        return list(ex.map(lambda job: parse_file(*job), jobs))
+
+# Cada upload/combinação de opções gera uma entrada; o limite evita que
+# arquivos antigos fiquem presos na memória do servidor
+@st.cache_data(show_spinner=False, max_entries=12)
+def _parse_bytes(data, is_excel, dayfirst, dec_br):
     # Leitura
     if is_excel:
-        df = pd.read_excel(uploaded, engine="openpyxl", dtype=str)
+        # calamine (Rust) já devolve células tipadas; openpyxl fica como fallback.
+        # Sem dtype_backend="pyarrow": planilhas misturam número e texto na mesma
+        # coluna ("-", "1.234,56") e o Arrow exige um único tipo por coluna
+        try:
+            df = pd.read_excel(io.BytesIO(data), engine="calamine")
+        except ImportError:
+            df = pd.read_excel(io.BytesIO(data), engine="openpyxl")
     else:
-        df = pd.read_csv(
-            uploaded,
-            sep=";",
-            dtype=str,
-            decimal="," if dec_br else ".",
-            thousands="." if dec_br else None,
-        )
-    # Converter datas
-    for col in df.columns:
-        if "Data" in col:
-            df[col] = pd.to_datetime(df[col], dayfirst=dayfirst, errors="coerce")
+        # Tudo chega como texto e os valores são convertidos abaixo
+        df = le_csv(data)
+    # Classificação das colunas em uma única passada
+    date_cols = [c for c in df.columns if DATE_COL_RE.search(c)]
+    num_cols  = [c for c in df.columns if NUM_COL_RE.search(c)]
+    # Converter datas: formatos explícitos usam o parser em C, em cascata
+    # (data, data com horário, ISO 8601); só o que não casar com nenhum cai
+    # na inferência (dateutil), linha a linha
+    fmt = "%d/%m/%Y" if dayfirst else "%Y-%m-%d"
+    for col in date_cols:
+        raw = df[col]
+        parsed = para_datetime(raw, format=fmt)
+        for f in (fmt + " %H:%M:%S", "ISO8601", "mixed"):
+            falhou = parsed.isna() & raw.notna()
+            if not falhou.any():
+                break
+            # O fuso é descartado célula a célula: vale sempre o horário escrito
+            # no arquivo, independente do fuso das outras linhas
+            texto = raw[falhou].astype(str).str.replace(TZ_SUFFIX_RE, r"\1", regex=True)
+            # fillna alinha pelo índice e só preenche o que ainda falta
+            parsed = parsed.fillna(para_datetime(texto, format=f, dayfirst=dayfirst))
+        df[col] = parsed
     # Converter valores
-    for col in df.columns:
-        if any(x in col for x in ["Valor", "Acréscimo", "Desconto", "Seguro", "Taxa"]):
-            s = df[col].astype(str)
-            if dec_br:
-                s = s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
-            df[col] = pd.to_numeric(s, errors="coerce")
-    return df
+    for col in num_cols:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        # Lido com dtype=str, a coluna já é texto: evita a cópia do astype
+        s = df[col] if pd.api.types.is_string_dtype(df[col]) else df[col].astype(str)
+        conv = to_br_float if dec_br else (lambda u: pd.to_numeric(u, errors="coerce"))
+        df[col] = converte_unicos(s, conv)
+    # Só as colunas "Data*" convertidas acima contam como datas: o calamine
+    # também devolve tipadas outras colunas (Emissão, Competência...)
+    # A chave (digest dos bytes + opções) identifica o conteúdo do upload para
+    # o cache do fluxo, calculada uma vez junto com o parse
+    chave = (hashlib.sha256(data).hexdigest(), is_excel, dayfirst, dec_br)
+    return df, tuple(date_cols), chave
+
+# --- Menor data entre as colunas de data de um DataFrame ---
+def first_date(df, date_cols):
+    return df[list(date_cols)].min().min() if date_cols else pd.NaT
+
+# --- Soma por data: np.unique dá as datas distintas (já ordenadas) e o índice
+# de cada linha; np.bincount acumula os valores por índice em um laço em C.
+# Agrupa pelo instante exato, como o groupby('Data') original ---
+def soma_por_data(datas, *valores):
+    if len(datas) == 0:
+        return (np.array([], dtype='datetime64[ns]'),) + tuple(np.zeros(0) for _ in valores)
+    unicas, idx = np.unique(datas, return_inverse=True)
+    somas = tuple(np.bincount(idx, weights=v, minlength=len(unicas)) for v in valores)
+    return (unicas.astype('datetime64[ns]'),) + somas
+
+# --- Consolidação do fluxo (cacheada pelas chaves dos uploads e saldo) ---
+# Os DataFrames ficam fora do hash (prefixo _): acima de 50 mil linhas o
+# Streamlit só amostra parte das linhas e uma correção pontual passaria batido
+@st.cache_data(show_spinner=False, max_entries=4)
+def gerar_fluxo(_df_rec, _df_paid, _df_pay, chaves, saldo_inicial):
+    # --- Entradas Recebidas vs A Receber ---
+    # Baixada -> data da baixa / valor líquido; senão -> vencimento / valor devido
+    baixa = _df_rec['Valor da baixa']
+    mask_rec = baixa.notna() & (baixa > 0)
+    mask_prev = baixa.isna() | (baixa == 0)
+    data = np.where(mask_rec, _df_rec['Data da baixa'], _df_rec['Data vencimento'])
+    entrada = np.where(mask_rec, _df_rec['Valor líquido'], _df_rec['Valor devido'])
+    keep = (mask_rec | mask_prev).to_numpy() & pd.notna(data) & pd.notna(entrada)
+    rec_fluxo = pd.DataFrame({'Data': data[keep], 'Entrada': entrada[keep]})
+
+    # --- Saídas Efetivas (Contas Pagas) com soma de aprop fin + aprop obra ---
+    paid_date_col = next((c for c in _df_paid.columns if "Data pagamento" in c), None)
+    if paid_date_col:
+        keep = _df_paid[paid_date_col].notna()
+        paid_fluxo = pd.DataFrame({
+            'Data': _df_paid.loc[keep, paid_date_col],
+            'Saída': _df_paid.loc[keep, 'Valor aprop fin'].fillna(0),
+        })
+    else:
+        paid_fluxo = pd.DataFrame({'Data': pd.Series(dtype='datetime64[ns]'), 'Saída': pd.Series(dtype=float)})
+
+    # --- Saídas a Realizar (Contas a Pagar) com soma de aprop fin + aprop obra ---
+    pay_date_col = next((c for c in _df_pay.columns if "Data vencimento" in c), None)
+    if pay_date_col:
+        keep = _df_pay[pay_date_col].notna()
+        pay_fluxo = pd.DataFrame({
+            'Data': _df_pay.loc[keep, pay_date_col],
+            'Saída': _df_pay.loc[keep, 'Valor aprop fin'].fillna(0),
+        })
+    else:
+        pay_fluxo = pd.DataFrame({'Data': pd.Series(dtype='datetime64[ns]'), 'Saída': pd.Series(dtype=float)})
+
+    # --- Consolidação ---
+    # Empilha as três fontes direto em arrays: Entrada só nas linhas de
+    # recebimento, Saída só nas de pagamento; o resto já nasce zerado
+    n_rec, n_paid = len(rec_fluxo), len(paid_fluxo)
+    datas = np.concatenate([
+        rec_fluxo['Data'].to_numpy(),
+        paid_fluxo['Data'].to_numpy(),
+        pay_fluxo['Data'].to_numpy(),
+    ])
+    entrada = np.zeros(len(datas))
+    entrada[:n_rec] = rec_fluxo['Entrada'].to_numpy()
+    saida = np.zeros(len(datas))
+    saida[n_rec:n_rec + n_paid] = paid_fluxo['Saída'].to_numpy()
+    saida[n_rec + n_paid:] = pay_fluxo['Saída'].to_numpy()
+
+    datas, entrada, saida = soma_por_data(datas, entrada, saida)
+    variacao = entrada - saida
+    fluxo = pd.DataFrame({
+        'Data': datas,
+        'Entrada': entrada,
+        'Saída': saida,
+        'Variação': variacao,
+        'Saldo Acumulado': saldo_inicial + np.cumsum(variacao),
+    })
+    return fluxo
 
 # --- Uploads e opções ---
 st.sidebar.header("Uploads")
@@ -52,9 +240,11 @@ with st.sidebar.expander("3. Contas a Pagar"):
     pay_val_br   = st.checkbox("Valores em formato brasileiro (1.234,56)",    key="pay_val")
 
 # --- Parse dos arquivos ---
-df_rec  = parse_file(excel_file, is_excel=True,  dayfirst=rec_date_br,  dec_br=rec_val_br)
-df_paid = parse_file(paid_file,   is_excel=False, dayfirst=paid_date_br, dec_br=paid_val_br)
-df_pay  = parse_file(pay_file,    is_excel=False, dayfirst=pay_date_br,  dec_br=pay_val_br)
+(df_rec, rec_dates, rec_key), (df_paid, paid_dates, paid_key), (df_pay, pay_dates, pay_key) = parse_files(
+    (excel_file, True,  rec_date_br,  rec_val_br),
+    (paid_file,  False, paid_date_br, paid_val_br),
+    (pay_file,   False, pay_date_br,  pay_val_br),
+)
 
 # Mostrar tabelas
 if df_rec is not None:
@@ -70,12 +260,11 @@ if df_pay is not None:
 # --- Fluxo de Caixa Diário ---
 if df_rec is not None and df_paid is not None and df_pay is not None:
     # Data inicial
-    all_dates = []
-    for df in (df_rec, df_paid, df_pay):
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                all_dates.append(df[col].min())
-    data_inicio = min(d for d in all_dates if pd.notnull(d))
+    data_inicio = min(filter(pd.notnull, (
+        first_date(df_rec, rec_dates),
+        first_date(df_paid, paid_dates),
+        first_date(df_pay, pay_dates),
+    )))
     st.markdown(f"**Data inicial detectada:** {data_inicio.date()}")
 
     saldo_inicial = st.number_input(
@@ -85,56 +274,7 @@ if df_rec is not None and df_paid is not None and df_pay is not None:
     )
 
     if st.button("Gerar Fluxo de Caixa"):
-        # --- Entradas Recebidas vs A Receber ---
-        mask_rec = df_rec.get('Valor da baixa').notna() & (df_rec['Valor da baixa'] > 0)
-        rec_received = (
-            df_rec.loc[mask_rec, ['Data da baixa', 'Valor líquido']]
-            .rename(columns={'Data da baixa': 'Data', 'Valor líquido': 'Entrada'})
-            .dropna()
-        )
-        mask_prev = df_rec.get('Valor da baixa').isna() | (df_rec['Valor da baixa'] == 0)
-        rec_expected = (
-            df_rec.loc[mask_prev, ['Data vencimento', 'Valor devido']]
-            .rename(columns={'Data vencimento': 'Data', 'Valor devido': 'Entrada'})
-            .dropna()
-        )
-        rec_fluxo = pd.concat([rec_received, rec_expected], ignore_index=True)
-
-        # --- Saídas Efetivas (Contas Pagas) com soma de aprop fin + aprop obra ---
-        paid_date_col = next((c for c in df_paid.columns if "Data pagamento" in c), None)
-        if paid_date_col:
-            paid_fluxo = df_paid[[paid_date_col, 'Valor aprop fin']].copy()
-            paid_fluxo['Saída'] = (
-                paid_fluxo['Valor aprop fin'].fillna(0)
-            )
-            paid_fluxo = paid_fluxo[[paid_date_col, 'Saída']].rename(columns={paid_date_col: 'Data'}).dropna()
-        else:
-            paid_fluxo = pd.DataFrame(columns=['Data','Saída'])
-
-        # --- Saídas a Realizar (Contas a Pagar) com soma de aprop fin + aprop obra ---
-        pay_date_col = next((c for c in df_pay.columns if "Data vencimento" in c), None)
-        if pay_date_col:
-            pay_fluxo = df_pay[[pay_date_col, 'Valor aprop fin']].copy()
-            pay_fluxo['Saída'] = (
-                pay_fluxo['Valor aprop fin'].fillna(0)
-            )
-            pay_fluxo = pay_fluxo[[pay_date_col, 'Saída']].rename(columns={pay_date_col: 'Data'}).dropna()
-        else:
-            pay_fluxo = pd.DataFrame(columns=['Data','Saída'])
-
-        # --- Consolidação ---
-        fluxo = (
-            pd.concat([rec_fluxo, paid_fluxo, pay_fluxo], ignore_index=True)
-              .assign(
-                  Entrada=lambda df: df.get('Entrada', 0).fillna(0),
-                  Saída=lambda df: df.get('Saída',    0).fillna(0)
-              )
-              .groupby('Data', as_index=False)
-              .agg({'Entrada':'sum','Saída':'sum'})
-              .sort_values('Data')
-        )
-        fluxo['Variação']         = fluxo['Entrada'] - fluxo['Saída']
-        fluxo['Saldo Acumulado']  = saldo_inicial + fluxo['Variação'].cumsum()
+        fluxo = gerar_fluxo(df_rec, df_paid, df_pay, (rec_key, paid_key, pay_key), saldo_inicial)
 
         st.subheader("Fluxo de Caixa Diário Aprimorado")
         st.dataframe(fluxo, use_container_width=True)